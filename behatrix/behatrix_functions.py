@@ -23,15 +23,124 @@ This file is part of Behatrix.
 
 import argparse
 import concurrent.futures
+import hashlib
 import itertools
+import multiprocessing
 import os
+import pathlib
+import pickle
 import random
+import re
 import sys
+import tempfile
+from collections import Counter
 import numpy as np
 
+try:
+    import numba
+    from numba import prange
+except ImportError:
+    numba = None
+    prange = range
+
 from behatrix import version
 
-SEPARATOR = "@%&£$"
+# rows of behavioral strings when behaviors are single characters:
+# tokens separated by whitespace (spaces inside a row are ignored)
+ROWS_PATTERN = re.compile(r"\S+(?: +\S+)*")
+
+# directory of cached results of behav_strings_stats_from_file
+CACHE_DIR = pathlib.Path(os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache") / "behatrix"
+
+
+def _jit(func=None, parallel: bool=False):
+    """
+    compile function with numba if available
+    the function is returned unchanged (pure Python) if numba is not installed
+
+    Args:
+        func (function): function to compile
+        parallel (bool): enable the numba parallel features (prange)
+
+    Returns:
+        function: compiled function or original function
+    """
+
+    if func is None:
+        return lambda f: _jit(f, parallel=parallel)
+    if numba is None:
+        return func
+    return numba.njit(cache=True, parallel=parallel)(func)
+
+
+def _run_jitted(func, *args, seed: int):
+    """
+    run a function compiled by _jit, the last arguments of function are seed and rng (random numbers generator)
+    the numba version uses the numba generator (rng is None).
+    The pure Python version (numba not installed or numba compilation failed)
+    uses a local np.random.RandomState seeded with seed.
+
+    Args:
+        func (function): function returned by _jit
+        args: arguments of function (without seed and rng)
+        seed (int): seed for the random numbers generator
+
+    Returns:
+        results of function
+    """
+
+    if numba is not None:
+        try:
+            return func(*args, seed, None)
+        except numba.core.errors.NumbaError as exc:
+            print(f"numba compilation failed, the pure Python version will be used (slow): {exc}", file=sys.stderr)
+
+    return getattr(func, "py_func", func)(*args, seed, np.random.RandomState(seed))
+
+
+# random numbers functions used by the jitted functions:
+# the pure Python versions use rng (np.random.RandomState),
+# the numba versions ignore rng and use the numba generator
+
+def _seed(rng, seed: int):
+    """
+    seed the random numbers generator (rng is already seeded in pure Python)
+    """
+
+
+def _randint(rng, low: int, high: int) -> int:
+    """
+    random integer in [low, high)
+    """
+    return rng.randint(low, high)
+
+
+def _shuffle(rng, a):
+    """
+    shuffle array in place
+    """
+    rng.shuffle(a)
+
+
+if numba is not None:
+
+    @numba.extending.overload(_seed)
+    def _seed_numba(rng, seed):
+        def impl(rng, seed):
+            np.random.seed(seed)
+        return impl
+
+    @numba.extending.overload(_randint)
+    def _randint_numba(rng, low, high):
+        def impl(rng, low, high):
+            return np.random.randint(low, high)
+        return impl
+
+    @numba.extending.overload(_shuffle)
+    def _shuffle_numba(rng, a):
+        def impl(rng, a):
+            np.random.shuffle(a)
+        return impl
 
 
 def remove_comments(s: str) -> str:
@@ -57,7 +166,8 @@ def behav_strings_stats(string: str,
                         behaviors_separator: str="",
                         chunk: int=0,
                         flag_remove_repetitions: bool=False,
-                        ngram: int=1) -> (bool, list):
+                        ngram: int=1,
+                        return_stats: bool=True) -> (bool, list):
     """
     extract some information from behavioral sequences
 
@@ -67,12 +177,22 @@ def behav_strings_stats(string: str,
         chunk (int): limit analysis to the chunk first characters
         flag_remove_repetitions (bool): if true remove behaviors repetions
         ngram (int): number of behaviors to group
+        return_stats (bool): if false transitions statistics (d, tot_trans, tot_trans_after_node) are not computed (None)
 
     Returns:
         bool: 0 -> OK
         list: sequences
-
-    return 0, sequences, d, nodes, starting_nodes, tot_nodes, tot_trans, tot_trans_after_node, behaviours
+        np.array: number of transitions between behaviours (indexed as behaviours list)
+        dict: number of occurrences of behaviours
+        dict: number of sequences starting with behaviour
+        int: total number of behaviours
+        int: total number of transitions
+        np.array: number of transitions after behaviour (indexed as behaviours list)
+        list: sorted unique behaviours
+        str: n-grams frequencies
+        dict: index of behaviour in behaviours list
+
+    return 0, sequences, d, nodes, starting_nodes, tot_nodes, tot_trans, tot_trans_after_node, behaviours, out_ngrams, beh_idx
     """
 
     # remove lines starting with #
@@ -83,27 +203,21 @@ def behav_strings_stats(string: str,
         rows = string.split("\n")   # split text in list
         flagOne = False
     else:
-        rows = string.replace(" ", "").split()
+        rows = ROWS_PATTERN.findall(string)
         flagOne = True
 
     sequences = []
 
-    d = {}
-    nodes = {}
-    starting_nodes = {}
+    nodes = Counter()
 
     min_chunk_length = 1e6
 
-    not_alnum = []
-    pos_not_alnum = 0
-    line_count = 0
-
     for row in rows:
         # skip empty line
         if not row:
             continue
 
-        r = list(row.strip()) if flagOne else row.strip().split(behaviors_separator)
+        r = list(row.replace(" ", "")) if flagOne else row.strip().split(behaviors_separator)
 
         # check if repetitions
         if flag_remove_repetitions:
@@ -114,65 +228,32 @@ def behav_strings_stats(string: str,
 
         sequences.append(r)
 
-        line_count += 1
-
         min_chunk_length = min(min_chunk_length, len(r))
 
-        for node in r:
-            if flagOne and not node.isalnum():
-                not_alnum = [line_count, ord(node)]
-
-            if node in nodes:
-                nodes[node] += 1
-            else:
-                nodes[node] = 1
-
-        for i in range(len(r) - 1):
-
-            # starting node
-            if i == 0:
-                if r[i] in starting_nodes:
-                    starting_nodes[r[i]] += 1
-                else:
-                    starting_nodes[r[i]] = 1
-
-            if r[i] + SEPARATOR + r[i + 1] in d:
-
-                d[r[i] + SEPARATOR + r[i + 1]] += 1
-
-            else:
-                d[r[i] + SEPARATOR + r[i + 1]] = 1
+        nodes.update(r)
 
-    # total number of transitions
-    tot_trans = 0
-    for i in d:
-        tot_trans += d[i]
+    # starting nodes (sequences with at least one transition)
+    starting_nodes = Counter(r[0] for r in sequences if len(r) > 1)
 
-    # number of transitions after behavior
-    tot_trans_after_node = {}
+    tot_nodes = sum(nodes.values())
 
-    for i in d:
+    # unique behaviors
+    behaviours = sorted(nodes)
 
-        b1, b2 = i.split(SEPARATOR)
+    # index of each behaviour in behaviours list
+    beh_idx = {behaviour: idx for idx, behaviour in enumerate(behaviours)}
 
-        if b1 in tot_trans_after_node:
-            tot_trans_after_node[b1] += d[i]
-        else:
-            tot_trans_after_node[b1] = d[i]
+    d, tot_trans, tot_trans_after_node = None, None, None
 
-    tot_nodes = 0
-    for node in nodes:
-        tot_nodes += nodes[node]
+    if return_stats:
+        # number of transitions between behaviours (d[i, j]: behaviours[i] -> behaviours[j])
+        d = create_observed_transition_matrix(sequences, behaviours, beh_idx)
 
-    behaviours = []
+        # total number of transitions
+        tot_trans = int(d.sum())
 
-    # extract unique behaviors
-    for seq in sequences:
-        for c in seq:
-            if c not in behaviours:
-                behaviours.append(c)
-
-    behaviours.sort()
+        # number of transitions after behavior
+        tot_trans_after_node = d.sum(axis=1)
 
     out_ngrams = ""
 
@@ -214,7 +295,60 @@ def behav_strings_stats(string: str,
                            f"{ngram_count} / {len(tot_ngrams)}\n"
                           )
 
-    return 0, sequences, d, nodes, starting_nodes, tot_nodes, tot_trans, tot_trans_after_node, behaviours, out_ngrams
+    return 0, sequences, d, nodes, starting_nodes, tot_nodes, tot_trans, tot_trans_after_node, behaviours, out_ngrams, beh_idx
+
+
+def behav_strings_stats_from_file(file_path: str, use_cache: bool=True, **kwargs):
+    """
+    extract some information from behavioral sequences contained in file (see behav_strings_stats)
+    the results are cached in CACHE_DIR and the cache is invalidated when the file
+    (modification time or size), the arguments or the Behatrix version change.
+    Only the last results are kept for each file.
+
+    Args:
+        file_path (str): path of file containing behavioral sequences
+        use_cache (bool): use the cached results
+        kwargs: arguments of behav_strings_stats
+
+    Returns:
+        see behav_strings_stats
+    """
+
+    if use_cache:
+        stat = os.stat(file_path)
+        path_key = hashlib.blake2b(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:16]
+        key = hashlib.blake2b((f"{stat.st_mtime_ns}|{stat.st_size}|"
+                               f"{version.__version__}|{sorted(kwargs.items())}").encode("utf-8")).hexdigest()[:16]
+        cache_path = CACHE_DIR / f"{path_key}-{key}.pickle"
+        try:
+            with open(cache_path, "rb") as f_in:
+                return pickle.load(f_in)
+        except Exception:
+            pass
+
+    with open(file_path) as f_in:
+        results = behav_strings_stats(f_in.read(), **kwargs)
+
+    if use_cache:
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # remove the outdated results and the temporary files left by interrupted runs for the same file
+            for pattern in (f"{path_key}-*.pickle", f"{path_key}-*.tmp"):
+                for old_cache_path in CACHE_DIR.glob(pattern):
+                    old_cache_path.unlink()
+            # write in a temporary file and rename it to not leave a truncated cache file
+            fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix=f"{path_key}-", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f_out:
+                    pickle.dump(results, f_out)
+                os.replace(tmp_path, cache_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            pass
+
+    return results
 
 
 def check_exclusion_list(exclusion_str, sequences, behaviors_separator=""):
@@ -280,63 +414,55 @@ def draw_diagram(cutoff_all,
         """
         create code for GraphViz
         return string containing graphviz code
+
+        unique_transitions and tot_trans_after_node are indexed as the behaviors list
+        the edges are written in the order of the behaviors list (not in order of first occurrence)
         """
 
 
-        def f_edge_label(edge_label,
-                         node1,
+        # percent factors computed once for all edges
+        ndigits = decimals_number if decimals_number else None
+        if edge_label == "percent_node":
+            # 100 / number of transitions after behavior
+            percent_factor = 100.0 / np.where(tot_trans_after_node > 0, tot_trans_after_node, 1)
+        else:
+            percent_factor = np.full(len(tot_trans_after_node), 100.0 / tot_trans if tot_trans else 0.0)
+
+        def f_edge_label(node1,
                          node2,
-                         di,
-                         tot_trans_after_node_i0,
-                         tot_trans,
-                         decimals_number,
+                         idx0,
+                         idx1,
                          pen_width=1):
 
-            if edge_label == "fraction_node":
-                return f'"{node1}" -> "{node2}" [label = "  {di}/{tot_trans_after_node_i0}" penwidth={pen_width}];\n'
+            di = unique_transitions[idx0, idx1]
 
-            elif edge_label == "percent_node":
-                percent = round(di / tot_trans_after_node[i0] * 100, decimals_number) if decimals_number else round(di / tot_trans_after_node[i0] * 100)
-                return f'"{node1}" -> "{node2}" [label = "  {percent} %" penwidth={pen_width}];\n'
+            if edge_label == "fraction_node":
+                return f'"{node1}" -> "{node2}" [label = "  {di}/{tot_trans_after_node[idx0]}" penwidth={pen_width}];\n'
 
-            elif edge_label == "percent_total":
-                percent = round(di / tot_trans * 100.0, decimals_number) if decimals_number else round(di / tot_trans * 100.0)
+            elif edge_label in ("percent_node", "percent_total"):
+                percent = round(di * percent_factor[idx0], ndigits)
                 return f'"{node1}" -> "{node2}" [label = "  {percent} %" penwidth={pen_width}];\n'
 
-        def width(p):
-            """
-            return pen width for graphviz script according the significativity
-
-            Args:
-               p (float): significativity
-
-            Returns:
-                int: pen width to be used in graphviz script
-            """
-
-            if p <= 0.001:
-                return 6
-            elif p <= 0.005:
-                return 3
-            else:
-                return 1
-
+        # pen width for graphviz script according the significativity
         if significativity is not None:
             print(significativity)
+            pen_widths = np.where(significativity <= 0.001, 6, np.where(significativity <= 0.005, 3, 1))
+        else:
+            pen_widths = np.ones(unique_transitions.shape, dtype=np.int64)
 
-        out = 'digraph G {\n'
+        out = ['digraph G {\n']
 
         # make png transparent
         if transparent_background:
-            out += 'graph [bgcolor="#ffffff00"]\n'
+            out.append('graph [bgcolor="#ffffff00"]\n')
 
         if cutoff_all:
 
-            for i in unique_transitions:
+            for idx0, idx1 in np.argwhere(unique_transitions > 0):
 
-                if unique_transitions[i] / tot_trans * 100.0 >= cutoff_all:
+                if unique_transitions[idx0, idx1] / tot_trans * 100.0 >= cutoff_all:
 
-                    i0, i1 = i.split(SEPARATOR)
+                    i0, i1 = behaviors[idx0], behaviors[idx1]
 
                     if i0 in starting_nodes:
                         node1 = f"{i0} ({starting_nodes[i0]})"
@@ -349,19 +475,17 @@ def draw_diagram(cutoff_all,
                     else:
                         node2 = f"{i1}"
 
-                    pen_width = width(significativity[behaviors.index(i0), behaviors.index(i1)]) if significativity is not None else 1
+                    pen_width = pen_widths[idx0, idx1]
 
-                    out += f_edge_label(edge_label, node1, node2, unique_transitions[i],
-                                        tot_trans_after_node[i0], tot_trans, decimals_number,
-                                        pen_width)
+                    out.append(f_edge_label(node1, node2, idx0, idx1, pen_width))
 
         elif cutoff_behavior:
 
-            for i in unique_transitions:
+            for idx0, idx1 in np.argwhere(unique_transitions > 0):
 
-                i0, i1 = i.split(SEPARATOR)
+                i0, i1 = behaviors[idx0], behaviors[idx1]
 
-                if unique_transitions[i] / tot_trans_after_node[i0] * 100 >= cutoff_behavior:
+                if unique_transitions[idx0, idx1] / tot_trans_after_node[idx0] * 100 >= cutoff_behavior:
 
                     if i0 in starting_nodes and include_first:
                         node1 = f"{i0} ({starting_nodes[i0]})"
@@ -374,17 +498,15 @@ def draw_diagram(cutoff_all,
                     else:
                         node2 = f"{i1}"
 
-                    pen_width = width(significativity[behaviors.index(i0), behaviors.index(i1)]) if significativity is not None else 1
+                    pen_width = pen_widths[idx0, idx1]
 
-                    out += f_edge_label(edge_label, node1, node2, unique_transitions[i],
-                                        tot_trans_after_node[i0], tot_trans, decimals_number,
-                                        pen_width)
+                    out.append(f_edge_label(node1, node2, idx0, idx1, pen_width))
 
         else:
 
-            for i in unique_transitions:
+            for idx0, idx1 in np.argwhere(unique_transitions > 0):
 
-                i0, i1 = i.split(SEPARATOR)
+                i0, i1 = behaviors[idx0], behaviors[idx1]
 
                 if i0 in starting_nodes:
                     node1 = f"{i0} ({starting_nodes[i0]})"
@@ -397,35 +519,91 @@ def draw_diagram(cutoff_all,
                 else:
                     node2 = f"{i1}"
 
-                pen_width = width(significativity[behaviors.index(i0), behaviors.index(i1)]) if significativity is not None else 1
+                pen_width = pen_widths[idx0, idx1]
+
+                out.append(f_edge_label(node1, node2, idx0, idx1, pen_width))
 
-                out += f_edge_label(edge_label,
-                                    node1,
-                                    node2,
-                                    unique_transitions[i],
-                                    tot_trans_after_node[i0],
-                                    tot_trans,
-                                    decimals_number,
-                                    pen_width)
+        out.append('}\n')
 
-        out += '}\n'
+        out = "".join(out)
 
         print(out)
         return out
 
 
-def create_observed_transition_matrix(sequences, behaviours):
+def create_observed_transition_matrix(sequences, behaviours, beh_idx=None):
     """
     create the matrix of observed transitions
+
+    Args:
+        sequences (list): list of sequences
+        behaviours (list): list of unique observed behaviours
+        beh_idx (dict): index of each behaviour in behaviours (built if None)
+
+    Returns:
+        np.array: matrix of observed transitions
     """
-    observed_matrix = np.zeros((len(behaviours), len(behaviours)))
+    n_behav = len(behaviours)
+    idx = beh_idx if beh_idx is not None else {behaviour: i for i, behaviour in enumerate(behaviours)}
 
+    src, dst = [], []
     for seq in sequences:
-        for i in range(len(seq) - 1):
-            if seq[i] in behaviours and seq[i + 1] in behaviours:
-                observed_matrix[behaviours.index(seq[i]), behaviours.index(seq[i + 1])] += 1
+        enc = np.fromiter((idx.get(c, -1) for c in seq), dtype=np.int64, count=len(seq))
+        src.append(enc[:-1])
+        dst.append(enc[1:])
+
+    if not src:
+        return np.zeros((n_behav, n_behav), dtype=np.int32)
+
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    # skip transitions with behaviours not in list
+    valid = (src >= 0) & (dst >= 0)
+
+    return np.bincount(src[valid] * n_behav + dst[valid], minlength=n_behav * n_behav).reshape(n_behav, n_behav).astype(np.int32)
+
+
+def create_exclusion_mask(exclusion_list: dict, beh_idx: dict, no_repetition: bool=False) -> np.array:
+    """
+    create the boolean mask of excluded transitions
+
+    Args:
+        exclusion_list (dict): dict of excluded behaviors ({"a": ["b", "c"]})
+        beh_idx (dict): index of each behaviour
+        no_repetition (bool): exclude repetitions of behaviors
+
+    Returns:
+        np.array: mask[i, j] is True if transition i -> j is excluded
+    """
+
+    excl_mask = np.zeros((len(beh_idx), len(beh_idx)), dtype=np.bool_)
+    for behav1 in exclusion_list:
+        for behav2 in exclusion_list[behav1]:
+            if behav1 in beh_idx and behav2 in beh_idx:
+                excl_mask[beh_idx[behav1], beh_idx[behav2]] = True
+
+    # avoid repetitions
+    if no_repetition:
+        np.fill_diagonal(excl_mask, True)
+
+    return excl_mask
+
 
-    return observed_matrix
+def save_matrix_tsv(file_name: str, matrix: np.array, behaviours: list, fmt: str="%d"):
+    """
+    save matrix in a TSV file with behaviours as header and row labels
+
+    Args:
+        file_name (str): path of TSV file
+        matrix (np.array): matrix to save
+        behaviours (list): list of behaviours (header and row labels)
+        fmt (str): format of values
+    """
+
+    with open(file_name, mode="w", encoding="utf-8") as f_out:
+        f_out.write("\t" + "\t".join(behaviours) + "\n")
+        for idx, behaviour in enumerate(behaviours):
+            f_out.write(behaviour + "\t")
+            np.savetxt(f_out, matrix[idx:idx + 1], fmt=fmt, delimiter="\t")
 
 
 def permutations_test(nrandom: int,
@@ -435,7 +613,8 @@ def permutations_test(nrandom: int,
                       block_first,
                       block_last,
                       observed_matrix: np.array,
-                      no_repetition: bool=False):
+                      no_repetition: bool=False,
+                      n_threads: int=1):
     """
     permutations test
 
@@ -446,136 +625,282 @@ def permutations_test(nrandom: int,
         block_first (bool): avoid that 1st behavior be permuted
         block_last (bool): avoid that last behavior be permuted
         observed_matrix (np.array): matrix of observed transitions number
+        no_repetition (bool): exclude repetitions of behaviors
+        n_threads (int): number of threads used by numba to run the permutations (requires numba)
 
     Returns:
         count_tot
         risu (numpy array)
     """
 
-    def strings_permutation(space: list,
-                            sequences: list,
-                            exclusion_list: list,
-                            block_first: bool,
-                            block_last: bool,
-                            no_repetition: bool=False) -> list:
-        """
-        create permutations of sequences following exclusions list, block first/last behavior
-
-        Args:
-            space (list): list of all behaviors ocuurences
-            sequences (list): list of behavioral sequences
-            exclusion_list (dict): dict of excluded behaviors
-            block_first (bool):
-
-        Returns:
-        
-            list: permuted sequences
-        """
-
-        space = list(space)
-        perm_sequences = []
+    beh_idx = {behaviour: idx for idx, behaviour in enumerate(behaviours)}
+
+    # encode sequences as a flat array of behaviour indexes
+    seqs = np.array([beh_idx[c] for seq in sequences for c in seq], dtype=np.int32)
+    offsets = np.cumsum([0] + [len(seq) for seq in sequences]).astype(np.int64)
+    # position in seqs of the first behaviour of each transition
+    pair_pos = np.array([pos for s in range(len(sequences)) for pos in range(offsets[s], offsets[s + 1] - 1)], dtype=np.int64)
+
+    # all the behaviours that can be permuted
+    space = np.array([beh_idx[c]
+                      for seq in sequences
+                      for c in seq[int(block_first):len(seq) - int(block_last)]], dtype=np.int32)
+
+    excl_mask = create_exclusion_mask(exclusion_list, beh_idx, no_repetition)
+
+    if n_threads > 1 and numba is not None:
+        n_threads = min(n_threads, numba.config.NUMBA_NUM_THREADS)
+        numba.set_num_threads(n_threads)
+        try:
+            return _permutations_batch(nrandom,
+                                       n_threads,
+                                       space,
+                                       seqs,
+                                       offsets,
+                                       pair_pos,
+                                       excl_mask,
+                                       bool(block_first),
+                                       bool(block_last),
+                                       np.asarray(observed_matrix, dtype=np.int32),
+                                       np.array([random.randrange(2 ** 32) for _ in range(n_threads)], dtype=np.int64))
+        except numba.core.errors.NumbaError as exc:
+            print(f"numba parallel compilation failed, the permutations will run on one thread: {exc}", file=sys.stderr)
+
+    return _run_jitted(_permute_and_count,
+                       nrandom,
+                       space,
+                       seqs,
+                       offsets,
+                       pair_pos,
+                       excl_mask,
+                       bool(block_first),
+                       bool(block_last),
+                       np.asarray(observed_matrix, dtype=np.int32),
+                       seed=random.randrange(2 ** 32))
+
+
+@_jit
+def _is_allowed(behaviour: int, prev: int, last: int, excl_mask) -> bool:
+    """
+    check if behaviour can follow prev (and precede last) according to the exclusions mask
 
-        for seq in sequences:
+    Args:
+        behaviour (int): index of candidate behaviour
+        prev (int): index of previous behaviour (-1 if none)
+        last (int): index of following blocked behaviour (-1 if none)
+        excl_mask (np.array): excl_mask[i, j] is True if transition i -> j is excluded
 
-            if block_first:
-                newseq = [seq[0]]
-                element = seq[0]
-            else:
-                newseq = []
-                element = ""
+    Returns:
+        bool: True if behaviour is allowed
+    """
 
-            for c in seq[int(block_first):len(seq) - int(block_last)]:
+    if prev >= 0 and excl_mask[prev, behaviour]:
+        return False
+    if last >= 0 and excl_mask[behaviour, last]:
+        return False
+    return True
+
+
+@_jit
+def _permute_and_count(nrandom: int,
+                       space,
+                       seqs,
+                       offsets,
+                       pair_pos,
+                       excl_mask,
+                       block_first: bool,
+                       block_last: bool,
+                       observed_matrix,
+                       seed: int,
+                       rng):
+    """
+    permute the encoded sequences nrandom times and count the permuted transitions >= observed transitions
 
-                if element in exclusion_list:
-                    lspazio3 = list(space)
-                    # remove element that are not permitted
-                    for i in exclusion_list[element]:
-                        # remove all excluded behaviors
-                        lspazio3 = list([x for x in lspazio3 if x != i])
+    The space is shuffled (Fisher-Yates) and its elements fill the free slots of sequences from left to right.
+    When an element is excluded after the previous behaviour it is swapped with an element
+    picked at random among the allowed ones remaining in the space
+    (a few random draws are tried before scanning the whole remaining space).
 
-                    lspazio2 = list(lspazio3)
-                else:
-                    lspazio2 = list(space)
+    Args:
+        nrandom (int): number of random permutations
+        space (np.array): encoded behaviours that can be permuted
+        seqs (np.array): encoded sequences concatenated
+        offsets (np.array): start of each sequence in seqs (last value is the length of seqs)
+        pair_pos (np.array): position in seqs of the first behaviour of each transition
+        excl_mask (np.array): excl_mask[i, j] is True if transition i -> j is excluded
+        block_first (bool): avoid that 1st behavior be permuted
+        block_last (bool): avoid that last behavior be permuted
+        observed_matrix (np.array): matrix of observed transitions number
+        seed (int): seed for the random numbers generator
+        rng (np.random.RandomState): random numbers generator of the pure Python version (None with numba)
 
-                if lspazio2:
-                    new_element = random.choice(lspazio2)
+    Returns:
+        int: number of permutations done
+        np.array: number of permuted transitions >= observed transitions
+    """
 
-                    # remove extracted behavior
-                    space.remove(new_element)
+    _seed(rng, seed)
+    n_behav = observed_matrix.shape[0]
+    n_space = space.shape[0]
+    results = np.zeros((n_behav, n_behav), dtype=np.uint32)
+    # permuted sequences (the blocked behaviours are not modified)
+    perm = seqs.copy()
+
+    count = 0
+    while count < nrandom:
+
+        _shuffle(rng, space)
+        failed = False
+        pos = 0
+
+        for s in range(offsets.shape[0] - 1):
+            start, end = offsets[s], offsets[s + 1]
+            first_slot = start + 1 if block_first else start
+            last_slot = end - 1 if block_last else end
+
+            prev = seqs[start] if block_first else -1
+
+            for k in range(first_slot, last_slot):
+
+                # check penultimate element: the transition to the blocked last behaviour must be allowed
+                last = seqs[end - 1] if block_last and k == last_slot - 1 else -1
+
+                if not _is_allowed(space[pos], prev, last, excl_mask):
+                    # try some random positions before scanning the whole remaining space
+                    for _ in range(8):
+                        j = _randint(rng, pos + 1, n_space) if pos + 1 < n_space else pos
+                        if _is_allowed(space[j], prev, last, excl_mask):
+                            space[pos], space[j] = space[j], space[pos]
+                            break
+
+                if not _is_allowed(space[pos], prev, last, excl_mask):
+                    n_allowed = 0
+                    for j in range(pos + 1, n_space):
+                        if _is_allowed(space[j], prev, last, excl_mask):
+                            n_allowed += 1
+
+                    if n_allowed == 0:
+                        failed = True
+                        break
+
+                    pick = _randint(rng, 0, n_allowed)
+                    for j in range(pos + 1, n_space):
+                        if _is_allowed(space[j], prev, last, excl_mask):
+                            if pick == 0:
+                                space[pos], space[j] = space[j], space[pos]
+                                break
+                            pick -= 1
+
+                perm[k] = space[pos]
+                prev = space[pos]
+                pos += 1
+
+            if failed:
+                break
+
+        if failed:
+            continue
 
-                else:
-                    return []
+        count += 1
+        transitions = np.bincount(perm[pair_pos] * n_behav + perm[pair_pos + 1],
+                                  minlength=n_behav * n_behav).reshape(n_behav, n_behav)
+        results += transitions >= observed_matrix
 
-                # check penultimate element
-                if block_last and len(newseq) == len(seq) - 2:   # DO NOT REPEAT LAST BEHAVIOUR
+    return count, results
 
-                    while (new_element in exclusion_list) and (seq[-1] in exclusion_list[new_element]):
-                        if lspazio2:
-                            new_element = random.choice(lspazio2)
-                        else:
-                            return []
 
-                        # remove last behaviour choosen and last behaviour from original string
-                        lspazio2 = list(space)
+@_jit(parallel=True)
+def _permutations_batch(nrandom: int,
+                        n_chunks: int,
+                        space,
+                        seqs,
+                        offsets,
+                        pair_pos,
+                        excl_mask,
+                        block_first: bool,
+                        block_last: bool,
+                        observed_matrix,
+                        seeds):
+    """
+    split the nrandom permutations in n_chunks run in parallel (prange) by _permute_and_count
+    each chunk accumulates its results in its own slice, the slices are summed at the end
 
-                        if element in lspazio2:
-                            lspazio2 = list([x for x in lspazio2 if x != element])
+    Args:
+        nrandom (int): number of random permutations
+        n_chunks (int): number of chunks (one for each thread)
+        seeds (np.array): seeds for the random numbers generator (one for each chunk)
+        see _permute_and_count for the other arguments
 
-                        if seq[-1] in lspazio2:
-                            lspazio2 = list([x for x in lspazio2 if x != seq[-1]])
+    Returns:
+        int: number of permutations done
+        np.array: number of permuted transitions >= observed transitions
+    """
 
-                newseq.append(new_element)
-                element = new_element
+    n_behav = observed_matrix.shape[0]
+    counts = np.zeros(n_chunks, dtype=np.int64)
+    partial_results = np.zeros((n_chunks, n_behav, n_behav), dtype=np.uint32)
 
-            if block_last:
-                newseq.append(seq[-1])
+    for c in prange(n_chunks):
+        n_random_by_chunk = nrandom // n_chunks + (1 if c < nrandom % n_chunks else 0)
+        count, results = _permute_and_count(n_random_by_chunk,
+                                            space.copy(),
+                                            seqs,
+                                            offsets,
+                                            pair_pos,
+                                            excl_mask,
+                                            block_first,
+                                            block_last,
+                                            observed_matrix,
+                                            seeds[c],
+                                            None)
+        counts[c] = count
+        partial_results[c] = results
 
-            perm_sequences.append(newseq)
+    return counts.sum(), partial_results.sum(axis=0).astype(np.uint32)
 
-        return perm_sequences
 
+# arguments of permutations_test shared with the worker processes (see init_permutations_worker)
+_worker_args = ()
 
-    space = []
-    for sequence in sequences:
-        space += sequence[int(block_first):len(sequence) - int(block_last)]
 
-    # modify exclusions list to avoid repetitions
-    if no_repetition:
-        for behavior in behaviours:
-            if behavior not in exclusion_list:
-                exclusion_list[behavior] = []
-            if behavior not in exclusion_list[behavior]:
-                exclusion_list[behavior].append(behavior)
+def permutations_mp_context():
+    """
+    multiprocessing context for the permutations test worker processes:
+    fork on GNU/Linux (the worker processes inherit the arguments without pickling),
+    default context on other platforms (fork is unsafe on MacOS and not available on Windows)
 
-    count, count_tot = 0, 0
+    Returns:
+        multiprocessing context or None (default context)
+    """
 
-    results = np.zeros((len(behaviours), len(behaviours)))
+    return multiprocessing.get_context("fork") if sys.platform.startswith("linux") else None
 
-    while True:
 
-        permuted_sequences = strings_permutation(space, sequences, exclusion_list, block_first, block_last)
+def init_permutations_worker(*args):
+    """
+    store the permutations_test arguments (except nrandom) in the worker process
+    the arguments are sent once by worker instead of once by submitted task
 
-        count_tot += 1
+    Args:
+        args: permutations_test arguments after nrandom
+    """
 
-        if permuted_sequences:
-            count += 1
+    global _worker_args
+    _worker_args = args
 
-            # analysis
-            permuted_transitions_matrix = np.zeros((len(behaviours), len(behaviours)))
 
-            for seq in permuted_sequences:
-                for i in range(len(seq) - 1):
-                    try:
-                        permuted_transitions_matrix[behaviours.index(seq[i]), behaviours.index(seq[i + 1])] += 1
-                    except Exception:
-                        print(str(sys.exc_info()[1]))
+def permutations_test_worker(nrandom: int):
+    """
+    run permutations_test in a worker process initialized with init_permutations_worker
 
-            results = results + (permuted_transitions_matrix >= observed_matrix)
+    Args:
+        nrandom (int): number of random permutations
 
-        if count == nrandom:
-            break
+    Returns:
+        see permutations_test
+    """
 
-    return count, results
+    return permutations_test(nrandom, *_worker_args)
 
 
 def levenshtein_distance(seq1: list, seq2: list) -> int:
@@ -761,6 +1086,7 @@ def main():
     parser.add_argument("--block_last", action="store_true", dest='block_last', help='block last behavior during permutations test')
     parser.add_argument("--no_repetition", action="store_true", dest='no_repetition', help='exclude repetitions during permutations test')
     parser.add_argument("--n-gram", action="store", default=1, dest='ngram', help='n-gram value', type=int)
+    parser.add_argument("--no_cache", action="store_true", dest='no_cache', help='do not use the cached results of previous analysis')
 
     parser.add_argument("--quiet", action="store_true", dest='quiet', default=False, help='Do not print results on terminal')
 
@@ -780,15 +1106,14 @@ def main():
             print(f"{args.sequences} is not a file\n")
             sys.exit()
 
-    with open(args.sequences) as f_in:
-        behav_str = f_in.read()
-
     (return_code, sequences,
      unique_transitions, nodes, starting_nodes, tot_nodes,
-     tot_trans, tot_trans_after_node, behaviours, ngrams_freq) = behav_strings_stats(behav_str,
-                                                                                     behaviors_separator=args.separator,
-                                                                                     chunk=0,
-                                                                                     ngram=args.ngram)
+     tot_trans, tot_trans_after_node, behaviours, ngrams_freq, beh_idx) = behav_strings_stats_from_file(args.sequences,
+                                                                                               use_cache=not args.no_cache,
+                                                                                               behaviors_separator=args.separator,
+                                                                                               chunk=0,
+                                                                                               ngram=args.ngram,
+                                                                                               return_stats=True)
 
 
     if args.nrandom:
@@ -826,16 +1151,13 @@ def main():
         print("Statistics\n==========")
         print(f'Number of different behaviours: {len(behaviours)}')
         print(f'Total number of behaviours: {tot_nodes}')
-        print(f'Number of different transitions: {len(unique_transitions)}')
+        print(f'Number of different transitions: {np.count_nonzero(unique_transitions)}')
         print(f'Total number of transitions: {tot_trans}')
 
         print('\nBehaviours frequencies:\n=======================')
 
         for behaviour in sorted(behaviours):
-            countBehaviour = 0
-            for seq in sequences:
-                countBehaviour += seq.count(behaviour)
-
+            countBehaviour = nodes[behaviour]
             print(f"{behaviour}\t{countBehaviour / tot_nodes:.3f}\t{countBehaviour} / {tot_nodes}")
 
         # n-grams
@@ -843,7 +1165,7 @@ def main():
             print(f"\nFrequencies of {args.ngram}-grams:\n=======================")
             print(ngrams_freq)
 
-    observed_matrix = create_observed_transition_matrix(sequences, behaviours)
+    observed_matrix = unique_transitions
 
     if not args.quiet:
         print("\nObserved transition matrix:\n===========================\n{}".format(observed_matrix))
@@ -853,17 +1175,7 @@ def main():
     else:
         file_name = f'{args.sequences}.observed_transitions.tsv'
 
-    np.savetxt(file_name, observed_matrix, fmt='%d', delimiter='\t')
-
-    with open(file_name, mode="r", encoding="utf-8") as f_in:
-        rows = f_in.readlines()
-
-    with open(file_name, mode="w", encoding="utf-8") as f_out:
-        f_out.write('\t' + '\t'.join(behaviours) + '\n')
-        c = 0
-        for row in rows:
-            f_out.write((behaviours)[c] + '\t' + row)
-            c += 1
+    save_matrix_tsv(file_name, observed_matrix, behaviours, fmt="%d")
 
 
     if nrandom:
@@ -877,35 +1189,49 @@ def main():
             else:
                 num_proc = num_available_proc - 1
 
-        results = np.zeros((len(behaviours), len(behaviours)))
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            lst = []
-            n_required_randomizations = 0
-            for i in range(num_proc):
-
-                if i < num_proc - 1:
-                    n_random_by_proc = nrandom // num_proc
-                else:
-                    n_random_by_proc = nrandom - n_required_randomizations
+        if numba is not None:
+            # permutations are run in parallel by numba threads
+            print("\nnumber of required permutations: ", nrandom)
+            nb_randomization_done, results = permutations_test(nrandom,
+                                                               sequences, behaviours,
+                                                               exclusion_list,
+                                                               block_first,
+                                                               block_last,
+                                                               observed_matrix,
+                                                               args.no_repetition,
+                                                               n_threads=num_proc)
+        else:
+            results = np.zeros((len(behaviours), len(behaviours)), dtype=np.uint32)
+            # the sequences and the observed matrix are sent once to each worker process
+            with concurrent.futures.ProcessPoolExecutor(max_workers=num_proc,
+                                                        mp_context=permutations_mp_context(),
+                                                        initializer=init_permutations_worker,
+                                                        initargs=(sequences, behaviours,
+                                                                  exclusion_list,
+                                                                  block_first,
+                                                                  block_last,
+                                                                  observed_matrix,
+                                                                  args.no_repetition)) as executor:
+                lst = []
+                n_required_randomizations = 0
+                for i in range(num_proc):
+
+                    if i < num_proc - 1:
+                        n_random_by_proc = nrandom // num_proc
+                    else:
+                        n_random_by_proc = nrandom - n_required_randomizations
 
-                lst.append(executor.submit(permutations_test,
-                                           n_random_by_proc,
-                                           sequences, behaviours,
-                                           exclusion_list,
-                                           block_first,
-                                           block_last,
-                                           observed_matrix,
-                                           args.no_repetition))
+                    lst.append(executor.submit(permutations_test_worker, n_random_by_proc))
 
-                n_required_randomizations += n_random_by_proc
+                    n_required_randomizations += n_random_by_proc
 
-            print("\nnumber of required permutations: ", n_required_randomizations)
+                print("\nnumber of required permutations: ", n_required_randomizations)
 
-            nb_randomization_done = 0
+                nb_randomization_done = 0
 
-            for l in lst:
-                nb_randomization_done += l.result()[0]
-                results += l.result()[1]
+                for l in lst:
+                    nb_randomization_done += l.result()[0]
+                    results += l.result()[1]
 
 
         print(f"Number of permutations done: {nb_randomization_done}")
@@ -918,17 +1244,7 @@ def main():
         else:
             file_name = '{fileName}.p-values.{nrandom}.tsv'.format(fileName=args.sequences, nrandom=nrandom)
 
-        np.savetxt(file_name, results / nrandom, fmt='%f', delimiter='\t')
-
-        with open(file_name, mode='r', encoding='utf-8') as f:
-            rows = f.readlines()
-
-        with open(file_name, mode='w', encoding='utf-8') as f:
-            f.write('\t' + '\t'.join(list(behaviours)) + '\n')
-            c = 0
-            for row in rows:
-                f.write((behaviours)[c] + "\t" + row)
-                c += 1
+        save_matrix_tsv(file_name, results / nrandom, behaviours, fmt="%f")
 
 
 if __name__ == '__main__':
@@ -217,7 +217,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             (return_code, sequences,
              d, nodes, starting_nodes, tot_nodes,
              tot_trans, tot_trans_after_node,
-             behaviours, ngrams_freq) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
+             behaviours, ngrams_freq, _) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
                                                             behaviors_separator=self.le_behaviors_separator.text(),
                                                             chunk=0,
                                                             flag_remove_repetitions=self.cb_remove_repeated_behaviors.isChecked(),
@@ -229,15 +229,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             output += ("\nStatistics\n==========\n")
             output += ('Number of different behaviours: {}\n'.format(len(behaviours)))
             output += ('Total number of behaviours: {}\n'.format(tot_nodes))
-            output += ('Number of different transitions: {}\n'.format(len(d)))
+            output += ('Number of different transitions: {}\n'.format(np.count_nonzero(d)))
             output += ('Total number of transitions: {}\n'.format(tot_trans))
             output += ('\nBehaviours frequencies:\n=======================\n')
 
             for behaviour in sorted(behaviours):
-                countBehaviour = 0
-                for seq in sequences:
-                    countBehaviour += seq.count(behaviour)
-
+                countBehaviour = nodes[behaviour]
                 output += "{behaviour}\t{freq:.3f}\t{countBehaviour} / {tot_nodes}\n".format(behaviour=behaviour,
                                                                                              freq=countBehaviour / tot_nodes,
                                                                                              countBehaviour=countBehaviour,
@@ -277,14 +274,15 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         (return_code, sequences,
          d, nodes, starting_nodes, tot_nodes,
          tot_trans, tot_trans_after_node,
-         behaviours, _) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
+         behaviours, _, beh_idx) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
                                                         behaviors_separator=self.le_behaviors_separator.text(),
                                                         chunk=0,
-                                                        flag_remove_repetitions=self.cb_remove_repeated_behaviors.isChecked())
+                                                        flag_remove_repetitions=self.cb_remove_repeated_behaviors.isChecked(),
+                                                        return_stats=False)
 
         if sequences:
 
-            observed_matrix = behatrix_functions.create_observed_transition_matrix(sequences, behaviours)
+            observed_matrix = behatrix_functions.create_observed_transition_matrix(sequences, behaviours, beh_idx)
 
             # display results
             # header
@@ -312,7 +310,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         (return_code, sequences,
          unique_transitions, nodes, starting_nodes, tot_nodes,
          tot_trans, tot_trans_after_node,
-         behaviors, _) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
+         behaviors, _, _) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
                                                        behaviors_separator=self.le_behaviors_separator.text(),
                                                        chunk=0,
                                                        flag_remove_repetitions=self.cb_remove_repeated_behaviors.isChecked()
@@ -563,9 +561,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         """
         (return_code, _,
          _, _, _, _,
-         _, _, behaviors, _) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
+         _, _, behaviors, _, _) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
                                                              behaviors_separator=self.le_behaviors_separator.text(),
-                                                             chunk=0)
+                                                             chunk=0,
+                                                             return_stats=False)
         self.pte_excluded_transitions.insertPlainText("\n")
         for behavior in behaviors:
             self.pte_excluded_transitions.insertPlainText(f"{behavior}:{behavior}\n")
@@ -617,10 +616,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             (return_code, sequences,
              d, nodes, starting_nodes, tot_nodes,
              tot_trans, tot_trans_after_node,
-             self.behaviours, _) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
+             self.behaviours, _, beh_idx) = behatrix_functions.behav_strings_stats(self.pte_behav_strings.toPlainText(),
                                                             behaviors_separator=self.le_behaviors_separator.text(),
                                                             chunk=0,
-                                                            flag_remove_repetitions=self.cb_remove_repeated_behaviors.isChecked()
+                                                            flag_remove_repetitions=self.cb_remove_repeated_behaviors.isChecked(),
+                                                            return_stats=False
                                                             )
 
             # check exclusion list
@@ -652,23 +652,38 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 if num_proc > self.nrandom:
                     num_proc = self.nrandom
 
-                observed_matrix = behatrix_functions.create_observed_transition_matrix(sequences, self.behaviours)
+                observed_matrix = behatrix_functions.create_observed_transition_matrix(sequences, self.behaviours, beh_idx)
 
                 self.pb_run_permutations_test.setEnabled(False)
                 self.nb_randomization_done = 0
-                pool = multiprocessing.Pool(processes = multiprocessing.cpu_count())
 
-                n_random_by_proc = round(self.nrandom / num_proc + 1)
+                if behatrix_functions.numba is not None:
+                    # permutations are run in parallel by numba threads in one process
+                    pool = multiprocessing.Pool(processes=1)
+                    permutations_args = [(self.nrandom,
+                                          sequences, self.behaviours,
+                                          exclusion_list,
+                                          self.cb_block_first_behavior.isChecked(),
+                                          self.cb_block_last_behavior.isChecked(),
+                                          observed_matrix,
+                                          False,
+                                          num_proc)]
+                else:
+                    pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
+                    n_random_by_proc = round(self.nrandom / num_proc + 1)
+                    permutations_args = [(n_random_by_proc,
+                                          sequences, self.behaviours,
+                                          exclusion_list,
+                                          self.cb_block_first_behavior.isChecked(),
+                                          self.cb_block_last_behavior.isChecked(),
+                                          observed_matrix)
+                                         ] * num_proc
 
                 pool.starmap_async(behatrix_functions.permutations_test,
-                                    [(n_random_by_proc,
-                                    sequences, self.behaviours,
-                                    exclusion_list,
-                                    self.cb_block_first_behavior.isChecked(),
-                                    self.cb_block_last_behavior.isChecked(),
-                                    observed_matrix)
-                                    ] * num_proc,
+                                    permutations_args,
                                     callback=self.permutations_test_finished)
+                # no more tasks: the worker processes exit when the permutations are done
+                pool.close()
 
             else:
                 QMessageBox.warning(self, "Behatrix", "Select the number of permutations to execute")
@@ -786,6 +801,7 @@ def cli():
     parser.add_argument("--block-last", action="store_true", dest="block_last", help="block last behavior during permutations test")
     parser.add_argument("--no-repetition", action="store_true", dest="no_repetition", help="exclude repetitions during permutations test")
     parser.add_argument("--n-gram", action="store", default=1, dest="ngram", help="n-gram value", type=int)
+    parser.add_argument("--no-cache", action="store_true", dest="no_cache", help="Do not use the cached results of previous analysis")
 
     parser.add_argument("-q", "--quiet", action="store_true", dest="quiet", default=False, help="Do not print results on terminal")
 
@@ -807,12 +823,10 @@ def cli():
             sys.exit()
 
 
-    with open(args.sequences) as f_in:
-        behav_str = f_in.read()
-
     (return_code, sequences, unique_transitions, nodes, starting_nodes, tot_nodes, tot_trans,
-     tot_trans_after_node, behaviours, ngrams_freq) = behatrix_functions.behav_strings_stats(
-         behav_str, behaviors_separator=args.separator, chunk=0, ngram=args.ngram)
+     tot_trans_after_node, behaviours, ngrams_freq, beh_idx) = behatrix_functions.behav_strings_stats_from_file(
+         args.sequences, use_cache=not args.no_cache, behaviors_separator=args.separator, chunk=0, ngram=args.ngram,
+         return_stats=True)
 
     if args.nrandom:
         nrandom = args.nrandom
@@ -851,16 +865,13 @@ def cli():
         print("Statistics\n==========")
         print(f'Number of different behaviours: {len(behaviours)}')
         print(f'Total number of behaviours: {tot_nodes}')
-        print(f'Number of different transitions: {len(unique_transitions)}')
+        print(f'Number of different transitions: {np.count_nonzero(unique_transitions)}')
         print(f'Total number of transitions: {tot_trans}')
 
         print('\nFrequencies of behaviors:\n=======================')
 
         for behaviour in sorted(behaviours):
-            countBehaviour = 0
-            for seq in sequences:
-                countBehaviour += seq.count(behaviour)
-
+            countBehaviour = nodes[behaviour]
             print(f"{behaviour}\t{countBehaviour / tot_nodes:.3f}\t{countBehaviour} / {tot_nodes}")
 
         # n-grams
@@ -868,7 +879,7 @@ def cli():
             print(f"\nFrequencies of {args.ngram}-grams:\n=======================")
             print(ngrams_freq)
 
-    observed_matrix = behatrix_functions.create_observed_transition_matrix(sequences, behaviours)
+    observed_matrix = unique_transitions
 
     if not args.quiet:
         print("\nObserved transition matrix:\n===========================\n{}".format(observed_matrix))
@@ -878,17 +889,7 @@ def cli():
     else:
         file_name = f'{args.sequences}.observed_transitions.tsv'
 
-    np.savetxt(file_name, observed_matrix, fmt='%d', delimiter='\t')
-
-    with open(file_name, mode="r", encoding="utf-8") as f_in:
-        rows = f_in.readlines()
-
-    with open(file_name, mode="w", encoding="utf-8") as f_out:
-        f_out.write('\t' + '\t'.join(behaviours) + '\n')
-        c = 0
-        for row in rows:
-            f_out.write((behaviours)[c] + '\t' + row)
-            c += 1
+    behatrix_functions.save_matrix_tsv(file_name, observed_matrix, behaviours, fmt="%d")
 
     # check if permutations test required
     if nrandom:
@@ -902,35 +903,49 @@ def cli():
             else:
                 num_proc = num_available_proc - 1
 
-        results = np.zeros((len(behaviours), len(behaviours)))
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            lst = []
-            n_required_randomizations = 0
-            for i in range(num_proc):
-
-                if i < num_proc - 1:
-                    n_random_by_proc = nrandom // num_proc
-                else:
-                    n_random_by_proc = nrandom - n_required_randomizations
+        if behatrix_functions.numba is not None:
+            # permutations are run in parallel by numba threads
+            print("\nnumber of required permutations: ", nrandom)
+            nb_randomization_done, results = behatrix_functions.permutations_test(nrandom,
+                                                                                  sequences, behaviours,
+                                                                                  exclusion_list,
+                                                                                  block_first,
+                                                                                  block_last,
+                                                                                  observed_matrix,
+                                                                                  args.no_repetition,
+                                                                                  n_threads=num_proc)
+        else:
+            results = np.zeros((len(behaviours), len(behaviours)), dtype=np.uint32)
+            # the sequences and the observed matrix are sent once to each worker process
+            with concurrent.futures.ProcessPoolExecutor(max_workers=num_proc,
+                                                        mp_context=behatrix_functions.permutations_mp_context(),
+                                                        initializer=behatrix_functions.init_permutations_worker,
+                                                        initargs=(sequences, behaviours,
+                                                                  exclusion_list,
+                                                                  block_first,
+                                                                  block_last,
+                                                                  observed_matrix,
+                                                                  args.no_repetition)) as executor:
+                lst = []
+                n_required_randomizations = 0
+                for i in range(num_proc):
+
+                    if i < num_proc - 1:
+                        n_random_by_proc = nrandom // num_proc
+                    else:
+                        n_random_by_proc = nrandom - n_required_randomizations
 
-                lst.append(executor.submit(behatrix_functions.permutations_test,
-                                           n_random_by_proc,
-                                           sequences, behaviours,
-                                           exclusion_list,
-                                           block_first,
-                                           block_last,
-                                           observed_matrix,
-                                           args.no_repetition))
+                    lst.append(executor.submit(behatrix_functions.permutations_test_worker, n_random_by_proc))
 
-                n_required_randomizations += n_random_by_proc
+                    n_required_randomizations += n_random_by_proc
 
-            print("\nnumber of required permutations: ", n_required_randomizations)
+                print("\nnumber of required permutations: ", n_required_randomizations)
 
-            nb_randomization_done = 0
+                nb_randomization_done = 0
 
-            for l in lst:
-                nb_randomization_done += l.result()[0]
-                results += l.result()[1]
+                for l in lst:
+                    nb_randomization_done += l.result()[0]
+                    results += l.result()[1]
 
         print(f"Number of permutations done: {nb_randomization_done}")
 
@@ -942,17 +957,8 @@ def cli():
         else:
             file_name = f"{args.sequences}.p-values.{nrandom}.tsv"
 
-        np.savetxt(file_name, results / nrandom, fmt='%f', delimiter='\t')
-
         try:
-            with open(file_name, mode="r", encoding="utf-8") as f:
-                rows = f.readlines()
-            with open(file_name, mode='w', encoding="utf-8") as f:
-                f.write("\t" + "\t".join(list(behaviours)) + "\n")
-                c = 0
-                for row in rows:
-                    f.write((behaviours)[c] + "\t" + row)
-                    c += 1
+            behatrix_functions.save_matrix_tsv(file_name, results / nrandom, behaviours, fmt="%f")
         except Exception:
             print(f"Error during creation of file: {file_name}")
 
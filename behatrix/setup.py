@@ -11,9 +11,8 @@ setup(
    long_description=open("README_pip.rst", "r").read(),
    #long_description_content_type="text/markdown",
    url="http://www.boris.unito.it/pages/behatrix",
-   python_requires=">=3.6",
+   python_requires=">=3.7",
    classifiers=[
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
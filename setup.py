@@ -11,12 +11,11 @@ setup(
    long_description=open("README_pip.rst", "r").read(),
    #long_description_content_type="text/markdown",
    url="http://www.boris.unito.it/pages/behatrix",
-   python_requires=">=3.6",
+   python_requires=">=3.7",
    classifiers=[
         "Operating System :: OS Independent",
         "Intended Audience :: Science/Research",
         "Intended Audience :: Education",
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',